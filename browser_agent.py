@@ -2,21 +2,22 @@
 
 import os
 import json
-import time
+import base64
+import hashlib
 import logging
 import uuid
 import threading
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, Any, Optional
 
-from google import genai
-from google.genai import types
-from google.genai.types import Content, Part
-from playwright.sync_api import sync_playwright, Page
 from dotenv import load_dotenv
 
+# google.genai and playwright are imported where they are first used, so
+# importing this module (and starting the MCP server) stays fast
+
 # Load environment variables
 load_dotenv()
 
@@ -27,11 +28,252 @@ SCREEN_WIDTH = int(os.environ.get("SCREEN_WIDTH", "1440"))
 SCREEN_HEIGHT = int(os.environ.get("SCREEN_HEIGHT", "900"))
 HEADLESS = os.environ.get("HEADLESS", "false").lower() == "true"
 
+# Screenshots sent to Gemini are downscaled to this longest edge and sent as JPEG.
+# Full-resolution PNGs are still saved to disk.
+MODEL_IMAGE_MAX_DIM = int(os.environ.get("MODEL_IMAGE_MAX_DIM", "1024"))
+MODEL_IMAGE_QUALITY = int(os.environ.get("MODEL_IMAGE_QUALITY", "75"))
+MODEL_IMAGE_MIME_TYPE = "image/jpeg"
+MODEL_IMAGE_SCALE = min(1.0, MODEL_IMAGE_MAX_DIM / max(SCREEN_WIDTH, SCREEN_HEIGHT))
+
+# Only the most recent screenshots are kept inline in the conversation history.
+# At least one is always kept, or the model would never see the current page.
+MAX_SCREENSHOTS_IN_CONTEXT = max(
+    1, int(os.environ.get("MAX_SCREENSHOTS_IN_CONTEXT", "3"))
+)
+
 # Default to system temp directory for screenshots when running via uvx
 # This ensures we have write permissions even in read-only environments
 _default_screenshot_dir = os.path.join(tempfile.gettempdir(), "gemini-browser-agent", "output_screenshots")
 SCREENSHOT_OUTPUT_DIR = os.environ.get("SCREENSHOT_OUTPUT_DIR", _default_screenshot_dir)
 
+# Plan cache: replay the actions of a previously successful run of the same task
+# on the same page before handing control to Gemini
+PLAN_CACHE = os.environ.get("PLAN_CACHE", "false").lower() == "true"
+PLAN_CACHE_DIR = os.environ.get(
+    "PLAN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp")
+)
+
+
+# Screenshots are written on a background thread so disk I/O overlaps with
+# the next Gemini call. One writer is shared by every agent, so short-lived
+# agents don't each leave a thread behind.
+_SCREENSHOT_WRITER = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="screenshot-writer"
+)
+
+
+def _write_screenshot(path: str, data: bytes):
+    """Write screenshot bytes to disk (runs on the writer thread).
+
+    Uses a raw file descriptor since the whole image is a single buffer.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+_GEMINI_CONFIG = None
+
+
+def _get_gemini_config():
+    """Return the Computer Use generation config, building it on first use."""
+    global _GEMINI_CONFIG
+    if _GEMINI_CONFIG is None:
+        from google.genai import types
+
+        # Configure Gemini with Computer Use
+        _GEMINI_CONFIG = types.GenerateContentConfig(
+            tools=[
+                types.Tool(
+                    computer_use=types.ComputerUse(
+                        environment=types.Environment.ENVIRONMENT_BROWSER
+                    )
+                )
+            ],
+        )
+    return _GEMINI_CONFIG
+
+
+def _load_plan(fingerprint: str) -> Optional[list]:
+    """Load a cached action sequence, or None if there is no usable entry."""
+    path = Path(PLAN_CACHE_DIR) / f"{fingerprint}.json"
+    try:
+        with open(path) as f:
+            return [(name, args) for name, args in json.load(f)["actions"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _store_plan(fingerprint: str, actions: list):
+    """Atomically write an action sequence to the plan cache."""
+    cache_dir = Path(PLAN_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"actions": actions}, f)
+        os.replace(tmp_path, cache_dir / f"{fingerprint}.json")
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _trim_screenshot_history(contents: list, keep: int):
+    """Drop inline screenshots from all but the last ``keep`` user turns.
+
+    Every turn re-uploads the whole history, so old screenshots would make
+    the payload grow with the square of the number of turns.
+    """
+    from google.genai.types import Part
+
+    seen = 0
+    for content in reversed(contents):
+        if content.role != "user":
+            continue
+        has_image = False
+        for i, part in enumerate(content.parts):
+            if part.inline_data:
+                has_image = True
+                if seen >= keep:
+                    content.parts[i] = Part(text="[earlier screenshot omitted]")
+            elif part.function_response and part.function_response.parts:
+                has_image = True
+                if seen >= keep:
+                    part.function_response.parts = None
+        if has_image:
+            seen += 1
+
+
+def _screenshot_hash(data: bytes) -> bytes:
+    """Return a short content hash used to detect unchanged screenshots."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# Actions that load a new document
+_NAV_ACTIONS = frozenset(("navigate", "go_back", "go_forward", "search"))
+
+# How long navigations may take to reach domcontentloaded before the action
+# is reported to the model as failed
+_NAV_TIMEOUT_MS = 10000
+
+# Actions that leave the page untouched
+_PASSIVE_ACTIONS = frozenset(("open_web_browser", "wait_5_seconds"))
+
+# Actions never written to the plan cache: typed text may be a credential.
+# A cached plan ends just before the first of these.
+_UNCACHED_ACTIONS = frozenset(("type_text_at",))
+
+_SCROLL_KEYS = {
+    "down": "PageDown",
+    "up": "PageUp",
+    "left": "ArrowLeft",
+    "right": "ArrowRight",
+}
+
+_REPLAY_NOTE = (
+    "Steps from a previous run of this task were replayed automatically. "
+    "Continue from the current page."
+)
+
+
+class TaskCancelled(Exception):
+    """Raised inside the agent loop once request_stop() has been called."""
+
+
+class BrowserPool:
+    """Keeps a warm Chromium instance per worker thread.
+
+    Playwright's sync API binds every object to the thread that created it,
+    so a browser cannot be handed between threads. Executor threads are
+    long-lived, though, so each one keeps its own browser running and every
+    task gets a fresh, isolated context from it.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def acquire(self):
+        """Return a new browser context, launching the thread's browser if needed."""
+        browser = getattr(self._local, "browser", None)
+        if browser is None or not browser.is_connected():
+            browser = self._launch()
+        return browser.new_context(
+            viewport={"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT}
+        )
+
+    def release(self, context):
+        """Close a context, dropping its cookies and storage, and keep the browser."""
+        context.close()
+
+    def close(self):
+        """Close this thread's browser and stop its Playwright instance.
+
+        Must be called from the thread that acquired the browser.
+        """
+        browser = getattr(self._local, "browser", None)
+        self._local.browser = None
+        if browser is not None:
+            try:
+                browser.close()
+            except Exception:
+                pass  # Already crashed or closed
+        self._stop_playwright()
+
+    def close_all(self, executor, workers: int, timeout: float = 10):
+        """Run close() once on each worker thread of an executor.
+
+        A barrier keeps a worker from picking up a second close job, so
+        every thread gets exactly one. Workers still busy after the
+        timeout are left alone.
+        """
+        barrier = threading.Barrier(workers)
+
+        def close_and_wait():
+            self.close()
+            try:
+                barrier.wait(timeout)
+            except threading.BrokenBarrierError:
+                pass
+
+        futures = [executor.submit(close_and_wait) for _ in range(workers)]
+        wait(futures, timeout)
+
+    def _launch(self):
+        """Launch the thread's browser, reusing its Playwright instance if it still works.
+
+        A thread can only run one sync Playwright instance at a time, so a
+        dead one is stopped before a new one is started.
+        """
+        from playwright.sync_api import sync_playwright
+
+        playwright = getattr(self._local, "playwright", None)
+        if playwright is not None:
+            try:
+                browser = playwright.chromium.launch(headless=HEADLESS)
+            except Exception:
+                self._stop_playwright()
+            else:
+                self._local.browser = browser
+                return browser
+
+        self._local.playwright = sync_playwright().start()
+        browser = self._local.playwright.chromium.launch(headless=HEADLESS)
+        self._local.browser = browser
+        return browser
+
+    def _stop_playwright(self):
+        playwright = getattr(self._local, "playwright", None)
+        self._local.playwright = None
+        if playwright is not None:
+            try:
+                playwright.stop()
+            except Exception:
+                pass  # Driver already gone
+
 
 class GeminiBrowserAgent:
     """
@@ -41,14 +283,23 @@ class GeminiBrowserAgent:
     Gemini's vision and action planning capabilities with Playwright.
     """
 
-    def __init__(self, logger=None):
-        """Initialize browser agent."""
+    def __init__(self, logger=None, browser_pool: Optional[BrowserPool] = None):
+        """Initialize browser agent.
+
+        Args:
+            logger: Optional logger instance
+            browser_pool: Optional pool to borrow a warm browser from instead of
+                launching a new one for this agent
+        """
         self.logger = logger or logging.getLogger("GeminiBrowserAgent")
+        self.browser_pool = browser_pool
 
         # Validate Gemini API key
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY environment variable not set")
 
+        from google import genai
+
         self.gemini_client = genai.Client(api_key=GEMINI_API_KEY)
 
         # Browser automation state
@@ -56,21 +307,76 @@ class GeminiBrowserAgent:
         self.browser = None
         self.context = None
         self.page = None
+        self._cdp = None
+
+        # Scale factors from Gemini's normalized 0-999 grid to viewport pixels
+        self._sx = SCREEN_WIDTH / 1000.0
+        self._sy = SCREEN_HEIGHT / 1000.0
+
+        # Computer Use function name -> handler
+        self._actions = {
+            "open_web_browser": self._act_open_web_browser,
+            "wait_5_seconds": self._act_wait_5_seconds,
+            "go_back": self._act_go_back,
+            "go_forward": self._act_go_forward,
+            "search": self._act_search,
+            "navigate": self._act_navigate,
+            "click_at": self._act_click_at,
+            "hover_at": self._act_hover_at,
+            "type_text_at": self._act_type_text_at,
+            "key_combination": self._act_key_combination,
+            "scroll_document": self._act_scroll_document,
+            "scroll_at": self._act_scroll_at,
+            "drag_and_drop": self._act_drag_and_drop,
+        }
+
+        # This agent's writes still queued on the shared screenshot writer
+        self._pending_writes = []
+
+        # Set by request_stop() from another thread; checked by the agent loop
+        self._stop_requested = threading.Event()
+
+        self.new_session()
+        self.logger.info("Initialized GeminiBrowserAgent")
+
+    def new_session(self):
+        """Start a fresh session so the agent can be reused for another task.
 
+        Assigns a new session ID and screenshot directory and resets all
+        per-task state. The browser itself is set up again by the next
+        execute_task call.
+        """
         # Screenshot session setup - persistent for entire browser session
         self.session_id = (
             datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(uuid.uuid4())[:8]
         )
         self.screenshot_dir = Path(SCREENSHOT_OUTPUT_DIR) / self.session_id
-        self.screenshot_dir.mkdir(parents=True, exist_ok=True)
+        self._screenshot_prefix = str(self.screenshot_dir) + os.sep + "step_"
         self.screenshot_counter = 0
 
-        # Progress tracking
+        # Hash of the last screenshot sent to Gemini, used to skip re-sending
+        # identical frames
+        self._last_screenshot_hash = None
+
+        # Load-state timeout (ms) to wait for before the next action or
+        # screenshot; 0 when the page is already settled
+        self._pending_wait_ms = 0
+
+        # Actions executed in the current task, recorded for the plan cache
+        # until the first uncached action
+        self._recorded_actions = None
+        self._recording_plan = False
+
+        self._stop_requested.clear()
+
+        # Progress tracking. A new list rather than clear(), since earlier
+        # results still reference the old one.
         self.progress_updates = []
+        # Optional callable that also receives each new progress entry
+        self.progress_callback = None
 
         self.logger.info(f"Browser session ID: {self.session_id}")
-        self.logger.info(f"Screenshots will be saved to: {self.screenshot_dir}")
-        self.logger.info("Initialized GeminiBrowserAgent")
+        self.logger.info(f"Screenshot directory: {self.screenshot_dir}")
 
     # ------------------------------------------------------------------ #
     # Browser automation
@@ -81,11 +387,16 @@ class GeminiBrowserAgent:
         try:
             mode = "headless" if HEADLESS else "headed"
             self.logger.info(f"Initializing browser ({mode} mode)...")
-            self.playwright = sync_playwright().start()
-            self.browser = self.playwright.chromium.launch(headless=HEADLESS)
-            self.context = self.browser.new_context(
-                viewport={"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT}
-            )
+            if self.browser_pool:
+                self.context = self.browser_pool.acquire()
+            else:
+                from playwright.sync_api import sync_playwright
+
+                self.playwright = sync_playwright().start()
+                self.browser = self.playwright.chromium.launch(headless=HEADLESS)
+                self.context = self.browser.new_context(
+                    viewport={"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT}
+                )
             self.page = self.context.new_page()
             self.logger.info("Browser ready!")
         except Exception as e:
@@ -93,18 +404,35 @@ class GeminiBrowserAgent:
             raise
 
     def cleanup_browser(self):
-        """Clean up Playwright browser resources."""
+        """Clean up Playwright browser resources.
+
+        Must be called from the thread that set up the browser.
+        """
+        self._flush_screenshots()
         try:
-            if self.browser:
-                self.browser.close()
-            if self.playwright:
-                self.playwright.stop()
+            if self.browser_pool:
+                if self.context:
+                    self.browser_pool.release(self.context)
+            else:
+                if self.browser:
+                    self.browser.close()
+                if self.playwright:
+                    self.playwright.stop()
             self.logger.info("Browser cleaned up successfully")
         except Exception as e:
             self.logger.error(f"Browser cleanup error: {e}")
+        finally:
+            self.playwright = None
+            self.browser = None
+            self.context = None
+            self.page = None
+            self._cdp = None
 
     def execute_task(
-        self, task: str, url: Optional[str] = "https://www.google.com"
+        self,
+        task: str,
+        url: Optional[str] = "https://www.google.com",
+        save_screenshots: bool = True,
     ) -> Dict[str, Any]:
         """
         Execute a browser automation task.
@@ -112,6 +440,7 @@ class GeminiBrowserAgent:
         Args:
             task: Description of the browsing task to perform
             url: Optional starting URL (defaults to Google)
+            save_screenshots: Write step screenshots to the session directory
 
         Returns:
             Dictionary with ok status and either data or error
@@ -121,6 +450,9 @@ class GeminiBrowserAgent:
             self.logger.info(f"Starting URL: {url}")
             self.logger.info(f"Session ID: {self.session_id}")
 
+            if save_screenshots:
+                self.screenshot_dir.mkdir(parents=True, exist_ok=True)
+
             # Setup browser if not already done
             if not self.page:
                 self.setup_browser()
@@ -137,129 +469,206 @@ class GeminiBrowserAgent:
                 self.logger.info("Starting from Google")
 
             # Run the browser automation loop
-            result = self._run_browser_automation_loop(task)
-
-            self.logger.info(
-                f"Task completed! Screenshots saved to: {self.screenshot_dir}"
+            result = self._run_browser_automation_loop(
+                task, save_screenshots=save_screenshots
             )
 
+            if save_screenshots:
+                self._flush_screenshots()
+                self.logger.info(
+                    f"Task completed! Screenshots saved to: {self.screenshot_dir}"
+                )
+            else:
+                self.logger.info("Task completed!")
+
             return {
                 "ok": True,
                 "data": result,
-                "screenshot_dir": str(self.screenshot_dir),
+                "screenshot_dir": str(self.screenshot_dir) if save_screenshots else None,
                 "session_id": self.session_id,
                 "progress": self.progress_updates,
             }
 
+        except TaskCancelled:
+            self.logger.info("Task cancelled")
+            return {"ok": False, "error": "Task cancelled"}
+
         except Exception as exc:
             self.logger.exception("Browser automation failed")
             return {"ok": False, "error": str(exc)}
 
-    def _run_browser_automation_loop(self, task: str, max_turns: int = 30) -> str:
+    def request_stop(self):
+        """Ask the running task to stop at its next turn or action.
+
+        Safe to call from any thread. The browser is left alone, since it
+        can only be cleaned up on the thread running the task.
+        """
+        self._stop_requested.set()
+
+    def _check_stop(self):
+        if self._stop_requested.is_set():
+            raise TaskCancelled()
+
+    def run_task(
+        self,
+        task: str,
+        url: Optional[str] = "https://www.google.com",
+        save_screenshots: bool = True,
+    ) -> Dict[str, Any]:
+        """Execute a task and clean up the browser on the same thread."""
+        try:
+            return self.execute_task(task, url, save_screenshots)
+        finally:
+            self.cleanup_browser()
+
+    def _run_browser_automation_loop(
+        self, task: str, max_turns: int = 30, save_screenshots: bool = True
+    ) -> str:
         """
         Run the Gemini Computer Use agent loop to complete the task.
 
         Args:
             task: The browsing task to complete
             max_turns: Maximum number of agent turns
+            save_screenshots: Write step screenshots to the session directory
 
         Returns:
             The final result as a string
         """
-        # Configure Gemini with Computer Use
-        config = types.GenerateContentConfig(
-            tools=[
-                types.Tool(
-                    computer_use=types.ComputerUse(
-                        environment=types.Environment.ENVIRONMENT_BROWSER
-                    )
-                )
-            ],
-        )
-
-        # Initial screenshot - take once and save
-        initial_screenshot = self.page.screenshot(type="png")
-        timestamp = datetime.now().strftime("%H%M%S")
-        screenshot_path = (
-            self.screenshot_dir
-            / f"step_{self.screenshot_counter:02d}_initial_{timestamp}.png"
-        )
-        with open(screenshot_path, "wb") as f:
-            f.write(initial_screenshot)
-        self.logger.info(f"Saved initial screenshot: {screenshot_path}")
-        self.screenshot_counter += 1
+        from google.genai.types import Content, FinishReason, Part
+
+        config = _get_gemini_config()
+
+        # Fast-forward through a cached plan for this task and page, if any
+        fingerprint = None
+        cached_plan = None
+        if PLAN_CACHE:
+            fingerprint = self._plan_fingerprint(task)
+            cached_plan = _load_plan(fingerprint)
+            self._recorded_actions = []
+            self._recording_plan = True
+            if cached_plan:
+                self._replay_plan(cached_plan)
+        else:
+            self._recorded_actions = None
+            self._recording_plan = False
+
+        # Initial screenshot
+        if save_screenshots:
+            self._save_screenshot(self._take_screenshot(), "initial_")
 
         # Build initial contents
-        contents = [
-            Content(
-                role="user",
-                parts=[
-                    Part(text=task),
-                    Part.from_bytes(data=initial_screenshot, mime_type="image/png"),
-                ],
-            )
-        ]
+        initial_model_image = self._take_model_screenshot()
+        self._last_screenshot_hash = _screenshot_hash(initial_model_image)
+        initial_parts = [Part(text=task)]
+        if cached_plan and self._recorded_actions:
+            initial_parts.append(Part(text=_REPLAY_NOTE))
+        initial_parts.append(
+            Part.from_bytes(data=initial_model_image, mime_type=MODEL_IMAGE_MIME_TYPE)
+        )
+        contents = [Content(role="user", parts=initial_parts)]
 
         self.logger.info(f"Starting browser automation loop for task: {task}")
         self._add_progress("Started browser automation", "info")
 
         # Agent loop
         for turn in range(max_turns):
+            self._check_stop()
+
+            # One timestamp per turn, shared by progress updates and filenames
+            turn_ts = datetime.now(timezone.utc)
+            # Filenames use local time, like the session directory name
+            turn_hms = turn_ts.astimezone().strftime("%H%M%S")
+            turn_iso = turn_ts.isoformat()
+
             self.logger.info(f"Turn {turn + 1}/{max_turns}")
-            self._add_progress(f"Turn {turn + 1}/{max_turns}", "turn")
+            self._add_progress(f"Turn {turn + 1}/{max_turns}", "turn", turn_iso)
 
             try:
-                # Get response from Gemini
-                response = self.gemini_client.models.generate_content(
+                # Stream the response from Gemini and execute each function call
+                # as soon as it arrives, overlapping browser actions with decoding
+                stream = self.gemini_client.models.generate_content_stream(
                     model=GEMINI_MODEL,
                     contents=contents,
                     config=config,
                 )
 
-                candidate = response.candidates[0]
-                contents.append(candidate.content)
+                # Single pass over the parts: function calls run immediately,
+                # text is collected for the final answer
+                parts = []
+                text_parts = []
+                results = []
+                finish_reason = None
+                block_reason = None
+                for chunk in stream:
+                    if chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+                        block_reason = chunk.prompt_feedback.block_reason
+                    if not chunk.candidates:
+                        continue
+                    candidate = chunk.candidates[0]
+                    if candidate.finish_reason:
+                        finish_reason = candidate.finish_reason
+                    if not candidate.content:
+                        continue
+                    for part in candidate.content.parts or []:
+                        parts.append(part)
+                        function_call = part.function_call
+                        if function_call:
+                            if not results:
+                                self.logger.info("Executing browser actions...")
+                                self._add_progress(
+                                    "Executing browser actions", "action", turn_iso
+                                )
+                            results.append(
+                                self._execute_gemini_function_call(function_call)
+                            )
+                        elif part.text:
+                            text_parts.append(part.text)
+
+                # A blocked prompt, an empty reply or a final answer cut short
+                # (safety, malformed call, token limit) is a failure, not an
+                # answer
+                if block_reason:
+                    raise RuntimeError(f"Gemini blocked the request: {block_reason}")
+                if not parts:
+                    raise RuntimeError(
+                        f"Gemini returned no content (finish reason: {finish_reason})"
+                    )
+                if not results and finish_reason != FinishReason.STOP:
+                    raise RuntimeError(
+                        f"Gemini stopped without finishing (finish reason: {finish_reason})"
+                    )
 
-                # Check if there are function calls
-                has_function_calls = any(
-                    part.function_call for part in candidate.content.parts
-                )
+                contents.append(Content(role="model", parts=parts))
 
-                if not has_function_calls:
-                    # No more actions - extract final text response
-                    text_response = " ".join(
-                        [part.text for part in candidate.content.parts if part.text]
-                    )
+                if not results:
+                    # No more actions - extract final text response. Streamed
+                    # text arrives in fragments, so join without a separator.
+                    text_response = "".join(text_parts)
                     self.logger.info(f"Agent finished: {text_response}")
 
                     # Save final screenshot
-                    timestamp = datetime.now().strftime("%H%M%S")
-                    screenshot_path = (
-                        self.screenshot_dir
-                        / f"step_{self.screenshot_counter:02d}_final_{timestamp}.png"
-                    )
-                    self.page.screenshot(path=str(screenshot_path))
-                    self.logger.info(f"Saved final screenshot: {screenshot_path}")
-                    self.screenshot_counter += 1
+                    if save_screenshots:
+                        self._save_screenshot(self._take_screenshot(), "final_", turn_hms)
+
+                    if (
+                        fingerprint
+                        and self._recorded_actions
+                        and self._recorded_actions != cached_plan
+                    ):
+                        try:
+                            _store_plan(fingerprint, self._recorded_actions)
+                        except OSError as e:
+                            self.logger.warning(f"Could not write plan cache: {e}")
 
                     return text_response
 
-                # Execute function calls
-                self.logger.info("Executing browser actions...")
-                self._add_progress("Executing browser actions", "action")
-                results = self._execute_gemini_function_calls(candidate)
-
                 # Get function responses with new screenshot
-                function_responses = self._get_gemini_function_responses(results)
-
-                # Save screenshot after actions
-                timestamp = datetime.now().strftime("%H%M%S")
-                screenshot_path = (
-                    self.screenshot_dir
-                    / f"step_{self.screenshot_counter:02d}_{timestamp}.png"
+                function_responses = self._get_gemini_function_responses(
+                    results, self._take_model_screenshot()
                 )
-                self.page.screenshot(path=str(screenshot_path))
-                self.logger.info(f"Saved screenshot: {screenshot_path}")
-                self.screenshot_counter += 1
+                if save_screenshots:
+                    self._save_screenshot(self._take_screenshot(), timestamp=turn_hms)
 
                 # Add function responses to contents
                 contents.append(
@@ -268,6 +677,10 @@ class GeminiBrowserAgent:
                         parts=[Part(function_response=fr) for fr in function_responses],
                     )
                 )
+                _trim_screenshot_history(contents, MAX_SCREENSHOTS_IN_CONTEXT)
+
+            except TaskCancelled:
+                raise
 
             except Exception as e:
                 self.logger.error(f"Error in browser automation loop: {e}")
@@ -276,140 +689,228 @@ class GeminiBrowserAgent:
         # If we hit max turns, return what we have
         return f"Task reached maximum turns ({max_turns}). Please check browser state."
 
-    def _execute_gemini_function_calls(self, candidate) -> list:
-        """Execute Gemini Computer Use function calls using Playwright."""
-        results = []
-        function_calls = [
-            part.function_call for part in candidate.content.parts if part.function_call
-        ]
+    def _execute_gemini_function_call(self, function_call) -> tuple:
+        """Execute a Gemini Computer Use function call using Playwright."""
+        fname = function_call.name
+        args = function_call.args
+        self.logger.info(f"Executing Gemini action: {fname}")
+        self._add_progress(f"Action: {fname}", "function_call")
 
-        for function_call in function_calls:
-            fname = function_call.name
-            args = function_call.args
-            self.logger.info(f"Executing Gemini action: {fname}")
-            self._add_progress(f"Action: {fname}", "function_call")
+        action_result = {}
 
-            action_result = {}
-
-            try:
-                if fname == "open_web_browser":
-                    pass  # Already open
-                elif fname == "wait_5_seconds":
-                    time.sleep(5)
-                elif fname == "go_back":
-                    self.page.go_back()
-                elif fname == "go_forward":
-                    self.page.go_forward()
-                elif fname == "search":
-                    self.page.goto("https://www.google.com")
-                elif fname == "navigate":
-                    self.page.goto(args["url"], wait_until="domcontentloaded", timeout=10000)
-                elif fname == "click_at":
-                    actual_x = self._denormalize_x(args["x"])
-                    actual_y = self._denormalize_y(args["y"])
-                    self.page.mouse.click(actual_x, actual_y)
-                elif fname == "hover_at":
-                    actual_x = self._denormalize_x(args["x"])
-                    actual_y = self._denormalize_y(args["y"])
-                    self.page.mouse.move(actual_x, actual_y)
-                elif fname == "type_text_at":
-                    actual_x = self._denormalize_x(args["x"])
-                    actual_y = self._denormalize_y(args["y"])
-                    text = args["text"]
-                    press_enter = args.get("press_enter", True)
-                    clear_before = args.get("clear_before_typing", True)
-
-                    self.page.mouse.click(actual_x, actual_y)
-                    if clear_before:
-                        self.page.keyboard.press("Meta+A")
-                        self.page.keyboard.press("Backspace")
-                    self.page.keyboard.type(text)
-                    if press_enter:
-                        self.page.keyboard.press("Enter")
-                elif fname == "key_combination":
-                    keys = args["keys"]
-                    self.page.keyboard.press(keys)
-                elif fname == "scroll_document":
-                    direction = args["direction"]
-                    if direction == "down":
-                        self.page.keyboard.press("PageDown")
-                    elif direction == "up":
-                        self.page.keyboard.press("PageUp")
-                    elif direction == "left":
-                        self.page.keyboard.press("ArrowLeft")
-                    elif direction == "right":
-                        self.page.keyboard.press("ArrowRight")
-                elif fname == "scroll_at":
-                    actual_x = self._denormalize_x(args["x"])
-                    actual_y = self._denormalize_y(args["y"])
-                    direction = args["direction"]
-                    magnitude = args.get("magnitude", 800)
-
-                    # Scroll by moving to position and using wheel
-                    self.page.mouse.move(actual_x, actual_y)
-                    scroll_amount = int(magnitude * SCREEN_HEIGHT / 1000)
-                    if direction == "down":
-                        self.page.mouse.wheel(0, scroll_amount)
-                    elif direction == "up":
-                        self.page.mouse.wheel(0, -scroll_amount)
-                    elif direction == "left":
-                        self.page.mouse.wheel(-scroll_amount, 0)
-                    elif direction == "right":
-                        self.page.mouse.wheel(scroll_amount, 0)
-                elif fname == "drag_and_drop":
-                    x = self._denormalize_x(args["x"])
-                    y = self._denormalize_y(args["y"])
-                    dest_x = self._denormalize_x(args["destination_x"])
-                    dest_y = self._denormalize_y(args["destination_y"])
-
-                    self.page.mouse.move(x, y)
-                    self.page.mouse.down()
-                    self.page.mouse.move(dest_x, dest_y)
-                    self.page.mouse.up()
+        try:
+            self._execute_action(fname, args)
+            if self._recording_plan:
+                if fname in _UNCACHED_ACTIONS:
+                    self._recording_plan = False
                 else:
-                    self.logger.warning(f"Unimplemented action: {fname}")
+                    self._recorded_actions.append((fname, dict(args or {})))
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error executing {fname}: {e}")
+            action_result = {"error": str(e)}
 
-                # Quick stability check - only wait if navigation occurred
-                if fname in ["navigate", "go_back", "go_forward", "search"]:
-                    self.page.wait_for_load_state("domcontentloaded", timeout=3000)
-                else:
-                    time.sleep(0.3)  # Brief pause for UI updates
+        # Get safety decision from the function call if present
+        safety_decision = None
+        if hasattr(function_call, 'safety_decision'):
+            safety_decision = function_call.safety_decision
+            self.logger.info(f"Safety decision present for {fname}: {safety_decision}")
+
+        return fname, action_result, safety_decision
 
+    def _plan_fingerprint(self, task: str) -> str:
+        """Fingerprint the task together with the current URL and visible text."""
+        dom = self.page.evaluate(
+            "() => document.body ? document.body.innerText.slice(0, 4000) : ''"
+        )
+        dom = " ".join(dom.split())
+        return hashlib.sha256((task + self.page.url + dom).encode()).hexdigest()
+
+    def _replay_plan(self, actions: list):
+        """Execute a cached action sequence, stopping at the first failure."""
+        self.logger.info(f"Plan cache hit, replaying {len(actions)} actions")
+        self._add_progress(f"Replaying {len(actions)} cached actions", "info")
+        for fname, args in actions:
+            self._check_stop()
+            # Plans written by older versions may still contain typed text
+            if fname in _UNCACHED_ACTIONS:
+                break
+            try:
+                self._execute_action(fname, args)
+            except TaskCancelled:
+                raise
             except Exception as e:
-                self.logger.error(f"Error executing {fname}: {e}")
-                action_result = {"error": str(e)}
+                self.logger.warning(f"Cached plan diverged at {fname}: {e}")
+                break
+            self._recorded_actions.append((fname, args))
+
+    def _execute_action(self, fname: str, args: Dict[str, Any]):
+        """Perform a single Computer Use action on the page."""
+        handler = self._actions.get(fname)
+        if handler is None:
+            self.logger.warning(f"Unimplemented action: {fname}")
+            return
+
+        self._check_stop()
+        self._settle()
+        handler(args)
+
+        # Navigation handlers already waited for domcontentloaded. Other
+        # actions don't block here; the page is settled lazily before the
+        # next action or screenshot.
+        if fname in _NAV_ACTIONS:
+            # The page definitely changed, never treat the next frame as a repeat
+            self._last_screenshot_hash = None
+        if fname not in _PASSIVE_ACTIONS:
+            self._pending_wait_ms = max(self._pending_wait_ms, 1000)
+
+    def _act_open_web_browser(self, args: Dict[str, Any]):
+        pass  # Already open
+
+    def _act_wait_5_seconds(self, args: Dict[str, Any]):
+        # Wakes early if the task is cancelled
+        self._stop_requested.wait(5)
+
+    def _act_go_back(self, args: Dict[str, Any]):
+        self.page.go_back(wait_until="domcontentloaded", timeout=_NAV_TIMEOUT_MS)
+
+    def _act_go_forward(self, args: Dict[str, Any]):
+        self.page.go_forward(wait_until="domcontentloaded", timeout=_NAV_TIMEOUT_MS)
+
+    def _act_search(self, args: Dict[str, Any]):
+        self.page.goto(
+            "https://www.google.com", wait_until="domcontentloaded", timeout=_NAV_TIMEOUT_MS
+        )
+
+    def _act_navigate(self, args: Dict[str, Any]):
+        self.page.goto(args["url"], wait_until="domcontentloaded", timeout=_NAV_TIMEOUT_MS)
+
+    def _act_click_at(self, args: Dict[str, Any]):
+        actual_x = self._denormalize_x(args["x"])
+        actual_y = self._denormalize_y(args["y"])
+        self.page.mouse.click(actual_x, actual_y)
+
+    def _act_hover_at(self, args: Dict[str, Any]):
+        actual_x = self._denormalize_x(args["x"])
+        actual_y = self._denormalize_y(args["y"])
+        self.page.mouse.move(actual_x, actual_y)
+
+    def _act_type_text_at(self, args: Dict[str, Any]):
+        actual_x = self._denormalize_x(args["x"])
+        actual_y = self._denormalize_y(args["y"])
+        text = args["text"]
+        press_enter = args.get("press_enter", True)
+        clear_before = args.get("clear_before_typing", True)
+
+        self.page.mouse.click(actual_x, actual_y)
+        if clear_before:
+            self.page.keyboard.press("Meta+A")
+            self.page.keyboard.press("Backspace")
+        self.page.keyboard.type(text)
+        if press_enter:
+            self.page.keyboard.press("Enter")
+
+    def _act_key_combination(self, args: Dict[str, Any]):
+        self.page.keyboard.press(args["keys"])
+
+    def _act_scroll_document(self, args: Dict[str, Any]):
+        key = _SCROLL_KEYS.get(args["direction"])
+        if key:
+            self.page.keyboard.press(key)
+
+    def _act_scroll_at(self, args: Dict[str, Any]):
+        actual_x = self._denormalize_x(args["x"])
+        actual_y = self._denormalize_y(args["y"])
+        direction = args["direction"]
+        magnitude = args.get("magnitude", 800)
+
+        # Scroll by moving to position and using wheel
+        self.page.mouse.move(actual_x, actual_y)
+        scroll_amount = int(magnitude * self._sy)
+        if direction == "down":
+            self.page.mouse.wheel(0, scroll_amount)
+        elif direction == "up":
+            self.page.mouse.wheel(0, -scroll_amount)
+        elif direction == "left":
+            self.page.mouse.wheel(-scroll_amount, 0)
+        elif direction == "right":
+            self.page.mouse.wheel(scroll_amount, 0)
+
+    def _act_drag_and_drop(self, args: Dict[str, Any]):
+        x, y, dest_x, dest_y = [
+            int(args[key] * scale)
+            for key, scale in (
+                ("x", self._sx),
+                ("y", self._sy),
+                ("destination_x", self._sx),
+                ("destination_y", self._sy),
+            )
+        ]
+
+        self.page.mouse.move(x, y)
+        self.page.mouse.down()
+        self.page.mouse.move(dest_x, dest_y)
+        self.page.mouse.up()
 
-            # Get safety decision from the function call if present
-            safety_decision = None
-            if hasattr(function_call, 'safety_decision'):
-                safety_decision = function_call.safety_decision
-                self.logger.info(f"Safety decision present for {fname}: {safety_decision}")
+    def _settle(self):
+        """Wait for the page to settle if the last action may have changed it."""
+        from playwright.sync_api import Error as PlaywrightError
 
-            results.append((fname, action_result, safety_decision))
+        timeout = self._pending_wait_ms
+        if not timeout:
+            return
+        self._pending_wait_ms = 0
+        try:
+            self.page.wait_for_load_state("domcontentloaded", timeout=timeout)
+            # Let one frame paint so UI updates from clicks and typing are
+            # visible. Hidden tabs pause rAF, so the timer bounds the wait.
+            self.page.evaluate(
+                "() => Promise.race(["
+                "new Promise(r => requestAnimationFrame(() => r())),"
+                "new Promise(r => setTimeout(r, 100))])"
+            )
+        except PlaywrightError as e:
+            self.logger.debug(f"Page did not settle: {e}")
 
-        return results
+    def _get_gemini_function_responses(self, results: list, screenshot_bytes: bytes):
+        """Generate function responses with current screenshot.
+
+        If the screenshot is identical to the last one sent, the image is
+        omitted and the response is flagged with ``screenshot_unchanged``.
+        """
+        from google.genai import types
 
-    def _get_gemini_function_responses(self, results: list):
-        """Generate function responses with current screenshot."""
-        screenshot_bytes = self.page.screenshot(type="png")
         current_url = self.page.url
         function_responses = []
 
+        screenshot_hash = _screenshot_hash(screenshot_bytes)
+        unchanged = screenshot_hash == self._last_screenshot_hash
+        self._last_screenshot_hash = screenshot_hash
+
+        screenshot_parts = None
+        if not unchanged:
+            screenshot_parts = [
+                types.FunctionResponsePart(
+                    inline_data=types.FunctionResponseBlob(
+                        mime_type=MODEL_IMAGE_MIME_TYPE, data=screenshot_bytes
+                    )
+                )
+            ]
+        else:
+            self.logger.info("Screenshot unchanged since last turn, not re-sending")
+
         for name, result, safety_decision in results:
             response_data = {"url": current_url}
             response_data.update(result)
+            if unchanged:
+                response_data["screenshot_unchanged"] = True
 
             # Build function response with safety acknowledgment if present
             func_response = types.FunctionResponse(
                 name=name,
                 response=response_data,
-                parts=[
-                    types.FunctionResponsePart(
-                        inline_data=types.FunctionResponseBlob(
-                            mime_type="image/png", data=screenshot_bytes
-                        )
-                    )
-                ],
+                parts=screenshot_parts,
             )
 
             # Acknowledge safety decision if present
@@ -420,18 +921,92 @@ class GeminiBrowserAgent:
 
         return function_responses
 
-    def _add_progress(self, message: str, event_type: str):
-        """Add a progress update with timestamp."""
-        self.progress_updates.append({
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+    def _cdp_session(self):
+        """Return the cached CDP session for the current page."""
+        if self._cdp is None:
+            self._cdp = self.context.new_cdp_session(self.page)
+        return self._cdp
+
+    def _take_screenshot(self) -> bytes:
+        """Capture the current page as full-resolution PNG bytes for disk.
+
+        Goes straight to CDP so the PNG Chromium encodes is used as-is.
+        """
+        self._settle()
+        result = self._cdp_session().send(
+            "Page.captureScreenshot", {"format": "png", "optimizeForSpeed": True}
+        )
+        return base64.b64decode(result["data"])
+
+    def _take_model_screenshot(self) -> bytes:
+        """Capture a downscaled JPEG of the current page for Gemini.
+
+        Chromium scales and encodes the image itself. Gemini works in
+        normalized 0-999 coordinates, so the reduced size does not affect
+        coordinate denormalization.
+        """
+        self._settle()
+        cdp = self._cdp_session()
+        # Clip coordinates are document-relative, so offset by the scroll position
+        viewport = cdp.send("Page.getLayoutMetrics")["cssVisualViewport"]
+        result = cdp.send("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": MODEL_IMAGE_QUALITY,
+            "optimizeForSpeed": True,
+            "clip": {
+                "x": viewport["pageX"],
+                "y": viewport["pageY"],
+                "width": viewport["clientWidth"],
+                "height": viewport["clientHeight"],
+                "scale": MODEL_IMAGE_SCALE,
+            },
+        })
+        return base64.b64decode(result["data"])
+
+    def _save_screenshot(
+        self, data: bytes, label: str = "", timestamp: Optional[str] = None
+    ):
+        """Queue screenshot bytes to be written to the session directory."""
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%H%M%S")
+        screenshot_path = (
+            f"{self._screenshot_prefix}{self.screenshot_counter:02d}_{label}{timestamp}.png"
+        )
+        self._pending_writes.append(
+            _SCREENSHOT_WRITER.submit(_write_screenshot, screenshot_path, data)
+        )
+        self.logger.info(f"Saving screenshot: {screenshot_path}")
+        self.screenshot_counter += 1
+
+    def _flush_screenshots(self):
+        """Wait for queued screenshot writes to finish."""
+        pending, self._pending_writes = self._pending_writes, []
+        wait(pending)
+        for future in pending:
+            if future.exception():
+                self.logger.error(f"Failed to save screenshot: {future.exception()}")
+
+    def _add_progress(
+        self, message: str, event_type: str, timestamp: Optional[str] = None
+    ):
+        """Add a progress update with timestamp (now, unless one is given)."""
+        update = {
+            "timestamp": timestamp or datetime.now(timezone.utc).isoformat(),
             "type": event_type,
             "message": message
-        })
+        }
+        self.progress_updates.append(update)
+        if self.progress_callback:
+            self.progress_callback(update)
 
     def _denormalize_x(self, x: int) -> int:
         """Convert normalized x coordinate (0-999) to actual pixel coordinate."""
-        return int(x / 1000 * SCREEN_WIDTH)
+        return int(x * self._sx)
 
     def _denormalize_y(self, y: int) -> int:
         """Convert normalized y coordinate (0-999) to actual pixel coordinate."""
-        return int(y / 1000 * SCREEN_HEIGHT)
+        return int(y * self._sy)
+
+
+# Shared browser pool for MCP tool calls
+browser_pool = BrowserPool()
@@ -12,8 +12,10 @@ Usage:
     uv run mcp install server.py
 """
 
+import os
 import logging
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from pathlib import Path
 
@@ -21,7 +23,7 @@ import anyio
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 
-from browser_agent import GeminiBrowserAgent
+from browser_agent import GeminiBrowserAgent, browser_pool
 from task_manager import task_manager
 
 # Load environment variables
@@ -39,9 +41,19 @@ logger = logging.getLogger("gemini-computer-use-mcp")
 # Create FastMCP server
 mcp = FastMCP("gemini-computer-use")
 
+# Bound concurrent browse_web calls; each one drives a real Chromium instance.
+# The dedicated pool keeps its worker threads (and their warm browsers) alive.
+MAX_CONCURRENT_BROWSE = int(os.environ.get("MAX_CONCURRENT_BROWSE", "3"))
+_BROWSE_SEM = asyncio.Semaphore(MAX_CONCURRENT_BROWSE)
+_BROWSE_POOL = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_BROWSE, thread_name_prefix="browse"
+)
+
 
 @mcp.tool()
-async def browse_web(task: str, url: str = "https://www.google.com") -> dict[str, Any]:
+async def browse_web(
+    task: str, url: str = "https://www.google.com", save_screenshots: bool = True
+) -> dict[str, Any]:
     """
     Browse the web to complete a task using AI-powered browser automation.
 
@@ -52,12 +64,14 @@ async def browse_web(task: str, url: str = "https://www.google.com") -> dict[str
     Args:
         task: What you want to accomplish (e.g., "Find the top 3 gaming laptops on Amazon")
         url: Starting webpage (defaults to Google)
+        save_screenshots: Save step screenshots to disk (default: True). Set to
+            False to skip disk writes when screenshots won't be reviewed.
 
     Returns:
         Dictionary containing:
         - ok: Boolean indicating success
         - data: Task completion message with results
-        - screenshot_dir: Path to saved screenshots
+        - screenshot_dir: Path to saved screenshots (None if not saved)
         - session_id: Unique session identifier
         - progress: List of actions taken during browsing
         - error: Error message (if task failed)
@@ -71,20 +85,20 @@ async def browse_web(task: str, url: str = "https://www.google.com") -> dict[str
     """
     logger.info(f"Received web browsing request: {task}")
 
-    # Create agent instance (browser will be cleaned up automatically)
-    agent = GeminiBrowserAgent(logger=logger)
+    # Create agent instance backed by the shared browser pool so repeat calls
+    # skip the Chromium cold start
+    agent = GeminiBrowserAgent(logger=logger, browser_pool=browser_pool)
 
-    try:
-        # Execute task in thread pool to avoid blocking
+    # Execute task in thread pool to avoid blocking. run_task cleans up on the
+    # worker thread, since Playwright objects are bound to their thread.
+    async with _BROWSE_SEM:
         loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, agent.execute_task, task, url)
-
-        logger.info(f"Task completed with status: {result.get('ok')}")
-        return result
+        result = await loop.run_in_executor(
+            _BROWSE_POOL, agent.run_task, task, url, save_screenshots
+        )
 
-    finally:
-        # Clean up browser resources
-        agent.cleanup_browser()
+    logger.info(f"Task completed with status: {result.get('ok')}")
+    return result
 
 
 @mcp.tool()
@@ -122,10 +136,14 @@ async def get_web_screenshots(session_id: str) -> dict[str, Any]:
                 "error": f"No screenshots found for session {session_id}"
             }
 
-        screenshots = sorted([
-            str(p.relative_to(screenshot_dir.parent))
-            for p in screenshot_dir.glob("*.png")
-        ])
+        prefix = session_id + os.sep
+        with os.scandir(screenshot_dir) as entries:
+            screenshots = [
+                prefix + entry.name
+                for entry in entries
+                if entry.name.endswith(".png")
+            ]
+        screenshots.sort()
 
         return {
             "ok": True,
@@ -143,7 +161,9 @@ async def get_web_screenshots(session_id: str) -> dict[str, Any]:
 
 
 @mcp.tool()
-async def start_web_task(task: str, url: str = "https://www.google.com") -> dict[str, Any]:
+async def start_web_task(
+    task: str, url: str = "https://www.google.com", save_screenshots: bool = True
+) -> dict[str, Any]:
     """
     Start a web browsing task in the background and return immediately.
 
@@ -153,12 +173,13 @@ async def start_web_task(task: str, url: str = "https://www.google.com") -> dict
     Args:
         task: What you want to accomplish on the web
         url: Starting webpage (defaults to Google)
+        save_screenshots: Save step screenshots to disk (default: True)
 
     Returns:
         Dictionary containing:
         - ok: Boolean indicating task was started successfully
         - task_id: Unique ID to check progress later
-        - status: Will be "running"
+        - status: "pending" until a worker is free, then "running"
         - message: Instructions for checking progress
 
     Examples:
@@ -172,11 +193,11 @@ async def start_web_task(task: str, url: str = "https://www.google.com") -> dict
     logger.info(f"Starting async web browsing task: {task}")
 
     # Create task
-    task_id = task_manager.create_task(task, url)
+    task_id = task_manager.create_task(task, url, save_screenshots)
 
     # Start task in background using anyio (FastMCP best practice)
     # Use anyio.to_thread.run_sync to run the blocking start_task in a thread
-    # We await it but start_task itself just spawns the thread and returns immediately
+    # We await it but start_task itself just queues the task and returns immediately
     success = await anyio.to_thread.run_sync(
         task_manager.start_task,
         task_id,
@@ -194,7 +215,7 @@ async def start_web_task(task: str, url: str = "https://www.google.com") -> dict
     return {
         "ok": True,
         "task_id": task_id,
-        "status": "running",
+        "status": task_manager.tasks[task_id].status,
         "message": f"Task started. Use check_web_task('{task_id}') to monitor progress."
     }
 
@@ -259,7 +280,7 @@ async def check_web_task(task_id: str, compact: bool = True) -> dict[str, Any]:
         **status
     }
 
-    if status.get("status") == "running":
+    if status.get("status") in ("pending", "running"):
         next_check = datetime.now(timezone.utc) + timedelta(seconds=5)
         result["recommended_poll_after"] = next_check.isoformat()
         result["polling_guidance"] = "Task in progress. Wait 5 seconds before next check to avoid context bloat."
@@ -379,7 +400,7 @@ async def list_web_tasks() -> dict[str, Any]:
         - ok: Boolean indicating success
         - tasks: Array of task status objects (compact format)
         - count: Total number of tasks
-        - active_count: Number of currently running tasks
+        - active_count: Number of pending or running tasks
 
     Examples:
         - list_web_tasks()
@@ -401,7 +422,13 @@ async def list_web_tasks() -> dict[str, Any]:
 
 def main():
     """Main entry point for the MCP server."""
-    mcp.run()
+    try:
+        mcp.run()
+    finally:
+        # Stop background tasks and close the warm browsers kept by the
+        # worker threads
+        task_manager.shutdown()
+        browser_pool.close_all(_BROWSE_POOL, MAX_CONCURRENT_BROWSE)
 
 
 if __name__ == "__main__":
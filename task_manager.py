@@ -4,12 +4,34 @@ Manages async browser automation tasks with status tracking.
 """
 
 import asyncio
+import heapq
+import os
+import queue
+import secrets
 import threading
+import time
+from collections import deque
+from itertools import islice
 from typing import Dict, Any, Optional
 from datetime import datetime, timezone
-import uuid
 
-from browser_agent import GeminiBrowserAgent
+from browser_agent import GeminiBrowserAgent, browser_pool
+
+
+# Progress entries kept per task; older entries are dropped first
+MAX_PROGRESS_UPDATES = 500
+
+# Background tasks running at once; further tasks queue until a worker frees up
+MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", "3"))
+
+_UTC = timezone.utc
+
+
+def _format_ts(ts: Optional[float]) -> Optional[str]:
+    """Format an epoch timestamp as an ISO 8601 UTC string."""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, _UTC).isoformat()
 
 
 class TaskStatus:
@@ -21,25 +43,111 @@ class TaskStatus:
     CANCELLED = "cancelled"
 
 
+# States a task can still be cancelled from
+_ACTIVE_STATES = frozenset((TaskStatus.PENDING, TaskStatus.RUNNING))
+
+
 class BrowserTask:
     """Represents a background browser automation task."""
 
-    def __init__(self, task_id: str, task_description: str, url: str):
+    __slots__ = (
+        "task_id",
+        "task_description",
+        "url",
+        "save_screenshots",
+        "status",
+        "created_at_ts",
+        "started_at_ts",
+        "completed_at_ts",
+        "result",
+        "error",
+        "agent",
+        "progress_updates",
+        "progress_count",
+        "queued",
+        "_lock",
+        "_dict_cache",
+        "_compact_cache",
+    )
+
+    def __init__(
+        self, task_id: str, task_description: str, url: str, save_screenshots: bool = True
+    ):
         self.task_id = task_id
         self.task_description = task_description
         self.url = url
+        self.save_screenshots = save_screenshots
         self.status = TaskStatus.PENDING
-        self.created_at = datetime.now(timezone.utc).isoformat()
-        self.started_at: Optional[str] = None
-        self.completed_at: Optional[str] = None
+        # Timestamps are stored as epoch seconds and only formatted as ISO
+        # strings when a response is built
+        self.created_at_ts: float = time.time()
+        self.started_at_ts: Optional[float] = None
+        self.completed_at_ts: Optional[float] = None
         self.result: Optional[Dict[str, Any]] = None
         self.error: Optional[str] = None
         self.agent: Optional[GeminiBrowserAgent] = None
-        self.progress_updates: list = []
+        self.progress_updates: deque = deque(maxlen=MAX_PROGRESS_UPDATES)
+        # Total updates seen, including any dropped from progress_updates
+        self.progress_count = 0
+        # Handed to the worker queue; the task stays PENDING until a worker
+        # picks it up
+        self.queued = False
         # Note: We don't store thread reference to avoid serialization issues
+        # Guards this task's state transitions, so unrelated tasks never
+        # contend with each other
+        self._lock = threading.Lock()
+
+        # Memoized (key, dict) pairs for to_dict/to_compact_dict. The key is
+        # (status, progress count); the pair is swapped in as one attribute so
+        # concurrent readers never see a key paired with another dict.
+        self._dict_cache: Optional[tuple] = None
+        self._compact_cache: Optional[tuple] = None
+
+    @property
+    def created_at(self) -> str:
+        return _format_ts(self.created_at_ts)
+
+    @property
+    def started_at(self) -> Optional[str]:
+        return _format_ts(self.started_at_ts)
+
+    @property
+    def completed_at(self) -> Optional[str]:
+        return _format_ts(self.completed_at_ts)
+
+    def _cache_key(self) -> tuple:
+        return (self.status, self.progress_count)
+
+    def add_progress(self, update: Dict[str, Any]):
+        """Record a progress update pushed by the task's agent.
+
+        Only the worker running the task calls this. The entry is appended
+        before the count is bumped, so a reader that sees the new count
+        also sees the entry.
+        """
+        self.progress_updates.append(update)
+        self.progress_count += 1
+
+    def invalidate_cache(self):
+        """Drop memoized dicts after fields change without a status change."""
+        self._dict_cache = None
+        self._compact_cache = None
 
     def to_dict(self) -> Dict[str, Any]:
-        """Convert task to dictionary for API responses."""
+        """Convert task to dictionary for API responses.
+
+        Each call returns a new top-level dict. Nested values are shared
+        with the memoized copy: ``progress`` is a tuple, and ``result`` and
+        the progress entries must be treated as read-only.
+        """
+        key = self._cache_key()
+        cache = self._dict_cache
+        if cache is None or cache[0] != key:
+            cache = (key, self._build_dict())
+            self._dict_cache = cache
+        return dict(cache[1])
+
+    def _build_dict(self) -> Dict[str, Any]:
         return {
             "task_id": self.task_id,
             "task_description": self.task_description,
@@ -48,7 +156,8 @@ class BrowserTask:
             "created_at": self.created_at,
             "started_at": self.started_at,
             "completed_at": self.completed_at,
-            "progress": self.progress_updates.copy() if self.progress_updates else [],
+            # A tuple, so the memoized dict's copies can share it safely
+            "progress": tuple(self.progress_updates),
             "result": self.result,
             "error": self.error,
         }
@@ -57,132 +166,277 @@ class BrowserTask:
         """Convert task to compact dictionary with progress summary.
 
         Returns a smaller response suitable for frequent polling to avoid
-        context window bloat in AI models.
+        context window bloat in AI models. Repeated polls of an unchanged
+        task reuse the previously built summary; each call gets its own
+        copy of the dict and of ``progress_summary``. ``result`` is shared
+        and must be treated as read-only.
         """
-        # Get last 3 progress items
-        recent_progress = []
-        if self.progress_updates:
-            recent_progress = [
-                item["message"] for item in self.progress_updates[-3:]
-            ]
+        key = self._cache_key()
+        cache = self._compact_cache
+        if cache is None or cache[0] != key:
+            cache = (key, self._build_compact_dict())
+            self._compact_cache = cache
+        compact = dict(cache[1])
+        compact["progress_summary"] = dict(compact["progress_summary"])
+        return compact
+
+    def _build_compact_dict(self) -> Dict[str, Any]:
+        # Get last 3 progress items. The tail is copied in one C-level call so
+        # a concurrent append can't invalidate the iterator mid-way.
+        tail = list(islice(reversed(self.progress_updates), 3))
+        recent_progress = tuple(item["message"] for item in reversed(tail))
+
+        # Add result or error if task is complete
+        status = self.status
+        if status == TaskStatus.COMPLETED:
+            extra = {"result": self.result}
+        elif status == TaskStatus.FAILED:
+            extra = {"error": self.error}
+        else:
+            extra = {}
 
         # Build compact response
-        compact = {
+        return {
             "task_id": self.task_id,
             "task_description": self.task_description,
             "url": self.url,
-            "status": self.status,
+            "status": status,
             "created_at": self.created_at,
             "started_at": self.started_at,
             "completed_at": self.completed_at,
             "progress_summary": {
-                "total_steps": len(self.progress_updates) if self.progress_updates else 0,
+                "total_steps": self.progress_count,
                 "recent_actions": recent_progress
-            }
+            },
+            **extra,
         }
 
-        # Add result or error if task is complete
-        if self.status == TaskStatus.COMPLETED:
-            compact["result"] = self.result
-        elif self.status == TaskStatus.FAILED:
-            compact["error"] = self.error
-
-        return compact
-
 
 class BrowserTaskManager:
-    """Manages background browser automation tasks."""
+    """Manages background browser automation tasks.
+
+    The manager's ``_lock`` only guards the ``tasks`` dict, its snapshot
+    and the completion heap; a task's state transitions are made under
+    that task's ``_lock``, and its progress is pushed in by the worker
+    running it. Reads rely on single dict lookups, attribute loads and
+    the published ``_tasks_snapshot`` tuple being atomic under the GIL,
+    so status polling is a pure read that never takes a lock. Writers set
+    ``status`` last, so a reader that sees a terminal status also sees the
+    fields that go with it.
+    """
 
     def __init__(self):
         self.tasks: Dict[str, BrowserTask] = {}
         self._lock = threading.Lock()
-
-    def create_task(self, task_description: str, url: str = "https://www.google.com") -> str:
+        # Immutable view of all tasks, republished by every add/remove so
+        # list_tasks can read it without any locking
+        self._tasks_snapshot: tuple = ()
+        # (completed_at_ts, task_id) min-heap of finished tasks so cleanup
+        # only visits the entries that have actually expired
+        self._completed_heap: list[tuple[float, str]] = []
+        # Long-lived worker threads fed from a queue, started by the first
+        # start_task. They are daemons so a server shutting down never waits
+        # on queued or running tasks.
+        self._queue: queue.Queue = queue.Queue()
+        self._workers: list[threading.Thread] = []
+        # Idle agents kept for reuse, at most one per worker
+        self._agent_pool: queue.Queue = queue.Queue(maxsize=MAX_CONCURRENT_TASKS)
+
+    def create_task(
+        self,
+        task_description: str,
+        url: str = "https://www.google.com",
+        save_screenshots: bool = True,
+    ) -> str:
         """Create a new browser automation task.
 
         Args:
             task_description: Description of the browsing task
             url: Starting URL
+            save_screenshots: Write step screenshots to disk
 
         Returns:
             task_id: Unique identifier for the task
         """
-        task_id = str(uuid.uuid4())
-        task = BrowserTask(task_id, task_description, url)
+        task_id = secrets.token_hex(16)
+        task = BrowserTask(task_id, task_description, url, save_screenshots)
 
         with self._lock:
             self.tasks[task_id] = task
+            self._tasks_snapshot = tuple(self.tasks.values())
 
         return task_id
 
     def start_task(self, task_id: str, logger=None) -> bool:
         """Start executing a task in the background.
 
+        The task is queued and stays pending until a worker is free.
+
         Args:
             task_id: Task identifier
             logger: Optional logger instance
 
         Returns:
-            True if task started, False if task not found or already running
+            True if task was queued, False if task not found or already started
         """
-        with self._lock:
-            task = self.tasks.get(task_id)
-            if not task or task.status != TaskStatus.PENDING:
-                return False
+        task = self.tasks.get(task_id)
+        if not task:
+            return False
 
-            task.status = TaskStatus.RUNNING
-            task.started_at = datetime.now(timezone.utc).isoformat()
+        with task._lock:
+            if task.status != TaskStatus.PENDING or task.queued:
+                return False
+            task.queued = True
 
-        # Run task in background thread (don't store reference)
-        thread = threading.Thread(
-            target=self._execute_task,
-            args=(task_id, logger),
-            daemon=True,
-            name=f"BrowserTask-{task_id[:8]}"
-        )
-        thread.start()
+        # Hand the task to the next free worker
+        self._start_workers()
+        self._queue.put((task, logger))
 
         if logger:
-            logger.info(f"Started background thread for task {task_id[:8]}... Thread: {thread.name}")
+            logger.info(f"Queued task {task_id[:8]}... on the background worker pool")
 
         return True
 
-    def _execute_task(self, task_id: str, logger=None):
-        """Execute the browser automation task (runs in background thread)."""
-        if logger:
-            logger.info(f"[Thread {threading.current_thread().name}] Starting execution for task {task_id[:8]}...")
+    def _start_workers(self):
+        """Start the worker threads if they aren't running yet."""
+        if self._workers:
+            return
 
         with self._lock:
-            task = self.tasks.get(task_id)
-            if not task:
+            if self._workers:
+                return
+            workers = [
+                threading.Thread(
+                    target=self._worker, name=f"BrowserTask-{i}", daemon=True
+                )
+                for i in range(MAX_CONCURRENT_TASKS)
+            ]
+            for worker in workers:
+                worker.start()
+            self._workers = workers
+
+    def _worker(self):
+        """Run queued tasks until shutdown() posts the stop sentinel."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            task, logger = item
+            try:
+                self._execute_task(task, logger)
+            except Exception as e:
+                # Keep the worker alive for the next task
                 if logger:
-                    logger.error(f"Task {task_id} not found in _execute_task")
+                    logger.error(f"Task {task.task_id[:8]}... worker error: {e}")
+
+        # The thread's warm browser can only be closed from this thread
+        browser_pool.close()
+
+    def shutdown(self, timeout: float = 10):
+        """Cancel unfinished tasks and stop the workers.
+
+        Running agents are signalled to stop. Each worker then closes its
+        browser and exits. Waits at most ``timeout`` seconds overall.
+        """
+        for task in self._tasks_snapshot:
+            self.cancel_task(task.task_id)
+
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+
+        for _ in workers:
+            self._queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def _execute_task(self, task: BrowserTask, logger=None):
+        """Execute the browser automation task (runs in background thread)."""
+        if logger:
+            logger.info(f"[Thread {threading.current_thread().name}] Starting execution for task {task.task_id[:8]}...")
+
+        with task._lock:
+            # Cancelled while waiting for a free worker
+            if task.status != TaskStatus.PENDING:
                 return
+            task.started_at_ts = time.time()
+            task.status = TaskStatus.RUNNING
 
         try:
-            # Create browser agent
-            agent = GeminiBrowserAgent(logger=logger)
-            task.agent = agent
+            agent = self._acquire_agent(logger)
+            # Progress goes straight into the task, so polls never touch the agent
+            agent.progress_callback = task.add_progress
+            with task._lock:
+                task.agent = agent
+                # Cancelled before cancel_task could see the agent
+                if task.status != TaskStatus.RUNNING:
+                    return
 
             # Execute the task
-            result = agent.execute_task(task.task_description, task.url)
-
-            with self._lock:
+            result = agent.execute_task(
+                task.task_description, task.url, task.save_screenshots
+            )
+
+            with task._lock:
+                # A cancelled task keeps its CANCELLED status
+                if task.status != TaskStatus.RUNNING:
+                    return
                 task.result = result
-                task.progress_updates = agent.progress_updates.copy()
+                task.completed_at_ts = time.time()
                 task.status = TaskStatus.COMPLETED
-                task.completed_at = datetime.now(timezone.utc).isoformat()
+                task.invalidate_cache()
+            self._index_completed(task)
 
         except Exception as e:
-            with self._lock:
+            with task._lock:
+                if task.status != TaskStatus.RUNNING:
+                    return
                 task.error = str(e)
+                task.completed_at_ts = time.time()
                 task.status = TaskStatus.FAILED
-                task.completed_at = datetime.now(timezone.utc).isoformat()
+                task.invalidate_cache()
+            self._index_completed(task)
 
         finally:
-            # Clean up browser
-            if task.agent:
-                task.agent.cleanup_browser()
+            # Clean up browser on this thread and hand the agent back for
+            # the next task. task.agent is cleared under the task lock so a
+            # late cancel_task can't signal the agent once it is reused.
+            agent = task.agent
+            if agent:
+                agent.cleanup_browser()
+                with task._lock:
+                    task.agent = None
+                self._release_agent(agent)
+
+    def _acquire_agent(self, logger=None) -> GeminiBrowserAgent:
+        """Take an idle agent from the pool, or create one if none is free.
+
+        Agents draw their browser from the shared browser pool, so a reused
+        agent skips both client setup and the Chromium launch.
+        """
+        try:
+            agent = self._agent_pool.get_nowait()
+        except queue.Empty:
+            return GeminiBrowserAgent(logger=logger, browser_pool=browser_pool)
+
+        if logger:
+            agent.logger = logger
+        agent.new_session()
+        return agent
+
+    def _release_agent(self, agent: GeminiBrowserAgent):
+        """Return an agent to the pool, dropping it if the pool is full."""
+        try:
+            self._agent_pool.put_nowait(agent)
+        except queue.Full:
+            pass
+
+    def _index_completed(self, task: BrowserTask):
+        """Record a finished task in the completion heap used by cleanup."""
+        with self._lock:
+            heapq.heappush(self._completed_heap, (task.completed_at_ts, task.task_id))
 
     def get_task_status(self, task_id: str, compact: bool = True) -> Optional[Dict[str, Any]]:
         """Get current status of a task.
@@ -194,20 +448,15 @@ class BrowserTaskManager:
         Returns:
             Task status dictionary or None if not found
         """
-        with self._lock:
-            task = self.tasks.get(task_id)
-            if not task:
-                return None
+        task = self.tasks.get(task_id)
+        if not task:
+            return None
 
-            # Get live progress from agent if task is running
-            if task.status == TaskStatus.RUNNING and task.agent:
-                task.progress_updates = task.agent.progress_updates.copy()
-
-            # Return compact or full format
-            if compact:
-                return task.to_compact_dict()
-            else:
-                return task.to_dict()
+        # Return compact or full format
+        if compact:
+            return task.to_compact_dict()
+        else:
+            return task.to_dict()
 
     def cancel_task(self, task_id: str) -> bool:
         """Cancel a running task.
@@ -218,19 +467,24 @@ class BrowserTaskManager:
         Returns:
             True if task was cancelled, False otherwise
         """
-        with self._lock:
-            task = self.tasks.get(task_id)
-            if not task or task.status not in [TaskStatus.PENDING, TaskStatus.RUNNING]:
+        task = self.tasks.get(task_id)
+        if not task:
+            return False
+
+        with task._lock:
+            if task.status not in _ACTIVE_STATES:
                 return False
 
+            task.completed_at_ts = time.time()
             task.status = TaskStatus.CANCELLED
-            task.completed_at = datetime.now(timezone.utc).isoformat()
 
-            # Clean up browser if running
+            # Only signal the agent; its worker thread stops at the next
+            # turn or action and cleans up the browser itself
             if task.agent:
-                task.agent.cleanup_browser()
+                task.agent.request_stop()
 
-            return True
+        self._index_completed(task)
+        return True
 
     def list_tasks(self) -> list[Dict[str, Any]]:
         """List all tasks.
@@ -238,8 +492,8 @@ class BrowserTaskManager:
         Returns:
             List of task status dictionaries
         """
-        with self._lock:
-            return [task.to_dict() for task in self.tasks.values()]
+        snapshot = self._tasks_snapshot
+        return [task.to_dict() for task in snapshot]
 
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """Remove completed tasks older than max_age_hours.
@@ -247,19 +501,21 @@ class BrowserTaskManager:
         Args:
             max_age_hours: Maximum age in hours before cleanup
         """
-        cutoff = datetime.now(timezone.utc).timestamp() - (max_age_hours * 3600)
+        cutoff = time.time() - (max_age_hours * 3600)
+        heap = self._completed_heap
+
+        # Fast path: nothing has expired yet
+        if not heap or heap[0][0] >= cutoff:
+            return
 
         with self._lock:
-            to_remove = []
-            for task_id, task in self.tasks.items():
-                if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
-                    if task.completed_at:
-                        completed_time = datetime.fromisoformat(task.completed_at).timestamp()
-                        if completed_time < cutoff:
-                            to_remove.append(task_id)
-
-            for task_id in to_remove:
-                del self.tasks[task_id]
+            removed = False
+            while heap and heap[0][0] < cutoff:
+                _, task_id = heapq.heappop(heap)
+                if self.tasks.pop(task_id, None) is not None:
+                    removed = True
+            if removed:
+                self._tasks_snapshot = tuple(self.tasks.values())
 
 
 # Global task manager instance
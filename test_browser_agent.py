@@ -0,0 +1,253 @@
+"""Tests for the agent loop, using a stub page and a scripted Gemini stream."""
+
+import base64
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+
+import browser_agent
+from browser_agent import GeminiBrowserAgent, _trim_screenshot_history
+
+
+class FakeInput:
+    """Records mouse and keyboard calls as (name, args) pairs."""
+
+    def __init__(self, calls, on_call=None):
+        self._calls = calls
+        self._on_call = on_call
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self._calls.append((name, args))
+            if self._on_call:
+                self._on_call()
+
+        return record
+
+
+class FakeCDP:
+    def send(self, method, params=None):
+        if method == "Page.getLayoutMetrics":
+            return {
+                "cssVisualViewport": {
+                    "pageX": 0,
+                    "pageY": 0,
+                    "clientWidth": 1440,
+                    "clientHeight": 900,
+                }
+            }
+        return {"data": base64.b64encode(b"screenshot").decode()}
+
+
+class FakePage:
+    url = "https://example.com"
+
+    def __init__(self, calls, on_call=None):
+        self.mouse = FakeInput(calls, on_call)
+        self.keyboard = FakeInput(calls, on_call)
+
+    def goto(self, *args, **kwargs):
+        pass
+
+    def wait_for_load_state(self, *args, **kwargs):
+        pass
+
+    def evaluate(self, script):
+        return "page text"
+
+
+class FakeContext:
+    def __init__(self, page):
+        self._page = page
+
+    def new_page(self):
+        return self._page
+
+    def new_cdp_session(self, page):
+        return FakeCDP()
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, page):
+        self._page = page
+
+    def acquire(self):
+        return FakeContext(self._page)
+
+    def release(self, context):
+        context.close()
+
+
+def model_turn(*parts, finish_reason=None):
+    return types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(
+                content=types.Content(role="model", parts=list(parts)),
+                finish_reason=finish_reason,
+            )
+        ]
+    )
+
+
+def call(name, **args):
+    return types.Part(function_call=types.FunctionCall(name=name, args=args))
+
+
+def answer(text="done"):
+    return model_turn(types.Part(text=text), finish_reason="STOP")
+
+
+@pytest.fixture
+def make_agent(monkeypatch, tmp_path):
+    """Build an agent whose Gemini stream replays one response per turn."""
+    monkeypatch.setattr(browser_agent, "GEMINI_API_KEY", "test")
+    monkeypatch.setattr(browser_agent, "SCREENSHOT_OUTPUT_DIR", tmp_path / "shots")
+
+    def make(*turns, on_call=None):
+        calls = []
+        agent = GeminiBrowserAgent(browser_pool=FakePool(FakePage(calls, on_call)))
+        responses = iter(turns)
+
+        def generate_content_stream(model, contents, config):
+            return iter(next(responses))
+
+        agent.gemini_client = SimpleNamespace(
+            models=SimpleNamespace(generate_content_stream=generate_content_stream)
+        )
+        agent.calls = calls
+        return agent
+
+    return make
+
+
+def test_task_returns_final_answer(make_agent):
+    agent = make_agent([model_turn(call("click_at", x=500, y=500))], [answer("42")])
+    result = agent.run_task("find the answer", "https://example.com")
+
+    assert result["ok"]
+    assert result["data"] == "42"
+    assert agent.calls[0][0] == "click"
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        [model_turn(finish_reason="MALFORMED_FUNCTION_CALL")],
+        [
+            types.GenerateContentResponse(
+                prompt_feedback=types.GenerateContentResponsePromptFeedback(
+                    block_reason="SAFETY"
+                )
+            )
+        ],
+        [model_turn(types.Part(text="I can"), finish_reason="SAFETY")],
+    ],
+    ids=["malformed", "blocked", "safety-cut"],
+)
+def test_incomplete_response_fails_the_task(make_agent, chunks):
+    result = make_agent(chunks).run_task("x", "https://example.com")
+    assert not result["ok"]
+
+
+def test_stop_request_cancels_remaining_actions(make_agent, caplog):
+    agent = make_agent(
+        [
+            model_turn(
+                call("click_at", x=1, y=1),
+                call("click_at", x=2, y=2),
+            )
+        ],
+        on_call=lambda: agent.request_stop(),
+    )
+
+    with caplog.at_level(logging.INFO):
+        result = agent.run_task("x", "https://example.com")
+
+    assert result == {"ok": False, "error": "Task cancelled"}
+    assert [name for name, _ in agent.calls] == ["click"]
+    assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+    assert [p.name for p in agent.screenshot_dir.iterdir()] == [
+        next(agent.screenshot_dir.glob("*initial_*")).name
+    ]
+
+
+def test_plan_cache_stops_recording_before_typed_text(make_agent, monkeypatch, tmp_path):
+    monkeypatch.setattr(browser_agent, "PLAN_CACHE", True)
+    monkeypatch.setattr(browser_agent, "PLAN_CACHE_DIR", str(tmp_path / "plans"))
+    agent = make_agent(
+        [
+            model_turn(
+                call("click_at", x=1, y=1),
+                call("type_text_at", x=1, y=1, text="hunter2", press_enter=True),
+                call("key_combination", keys="Enter"),
+            )
+        ],
+        [answer()],
+    )
+
+    assert agent.run_task("log in", "https://example.com")["ok"]
+
+    (plan_file,) = (tmp_path / "plans").iterdir()
+    plan = json.loads(plan_file.read_text())
+    assert [name for name, _ in plan["actions"]] == ["click_at"]
+    assert "hunter2" not in plan_file.read_text()
+
+
+def screenshot_turn():
+    return types.Content(
+        role="user",
+        parts=[types.Part.from_bytes(data=b"img", mime_type="image/png")],
+    )
+
+
+def function_response_turn():
+    return types.Content(
+        role="user",
+        parts=[
+            types.Part(
+                function_response=types.FunctionResponse(
+                    name="click_at",
+                    response={"url": "https://example.com"},
+                    parts=[
+                        types.FunctionResponsePart(
+                            inline_data=types.FunctionResponseBlob(
+                                mime_type="image/png", data=b"img"
+                            )
+                        )
+                    ],
+                )
+            )
+        ],
+    )
+
+
+def has_image(content):
+    part = content.parts[0]
+    return bool(part.inline_data or (part.function_response and part.function_response.parts))
+
+
+@pytest.mark.parametrize("keep", [1, 2])
+def test_trim_screenshot_history_keeps_recent_images(keep):
+    contents = [
+        screenshot_turn(),
+        model_turn(call("click_at", x=1, y=1)).candidates[0].content,
+        function_response_turn(),
+        model_turn(call("click_at", x=2, y=2)).candidates[0].content,
+        function_response_turn(),
+    ]
+
+    _trim_screenshot_history(contents, keep)
+
+    user_turns = [c for c in contents if c.role == "user"]
+    assert [has_image(c) for c in user_turns] == [False] * (3 - keep) + [True] * keep
+    assert user_turns[0].parts[0].text == "[earlier screenshot omitted]"
+    # Function responses keep their payload, only the image is dropped
+    assert user_turns[1].parts[0].function_response.response == {
+        "url": "https://example.com"
+    }
@@ -1,71 +1,57 @@
 #!/usr/bin/env python3
 """Test script to validate MCP server structure without running it."""
 
+import hashlib
+import importlib.util
 import sys
 from pathlib import Path
 
-def test_imports():
-    """Test that all required modules can be imported."""
-    print("Testing imports...")
+# Marker files for sources that already parsed cleanly, keyed by content hash.
+# Whether a file parses depends on the interpreter, so each one gets its own
+# directory (e.g. ast_cache/cpython-312).
+AST_CACHE_DIR = (
+    Path.home() / ".cache" / "computer-use-mcp" / "ast_cache"
+    / f"{sys.implementation.name}-{sys.version_info[0]}{sys.version_info[1]}"
+)
+
+def parse_source(path):
+    """Syntax-check a source file, skipping the parse if it is unchanged.
+
+    A source whose hash has a marker in AST_CACHE_DIR parsed cleanly
+    before on this interpreter version, so only new or edited files are
+    run through ast.parse.
+    """
+    source = Path(path).read_bytes()
+    marker = AST_CACHE_DIR / f"{hashlib.sha256(source).hexdigest()}.marker"
+    if marker.exists():
+        return
+
+    import ast
+    ast.parse(source, filename=str(path))
 
     try:
-        import logging
-        print("✓ logging")
-    except ImportError as e:
-        print(f"✗ logging: {e}")
-        return False
-
-    try:
-        import asyncio
-        print("✓ asyncio")
-    except ImportError as e:
-        print(f"✗ asyncio: {e}")
-        return False
-
-    try:
-        from pathlib import Path
-        print("✓ pathlib")
-    except ImportError as e:
-        print(f"✗ pathlib: {e}")
-        return False
-
-    return True
-
-def test_browser_agent():
-    """Test browser_agent.py can be parsed."""
-    print("\nTesting browser_agent.py...")
-
-    try:
-        import ast
-        browser_agent_path = Path(__file__).parent / "browser_agent.py"
-        with open(browser_agent_path) as f:
-            ast.parse(f.read())
-        print("✓ browser_agent.py syntax valid")
-        return True
-    except SyntaxError as e:
-        print(f"✗ browser_agent.py syntax error: {e}")
-        return False
-    except Exception as e:
-        print(f"✗ browser_agent.py error: {e}")
-        return False
-
-def test_server():
-    """Test server.py can be parsed."""
-    print("\nTesting server.py...")
+        AST_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+    except OSError:
+        pass  # Cache is best-effort
+
+def test_modules():
+    """Test that the server modules can be parsed."""
+    all_valid = True
+    base_path = Path(__file__).parent
+    for filename in ("browser_agent.py", "server.py"):
+        print(f"\nTesting {filename}...")
+        try:
+            parse_source(base_path / filename)
+            print(f"✓ {filename} syntax valid")
+        except SyntaxError as e:
+            print(f"✗ {filename} syntax error: {e}")
+            all_valid = False
+        except Exception as e:
+            print(f"✗ {filename} error: {e}")
+            all_valid = False
 
-    try:
-        import ast
-        server_path = Path(__file__).parent / "server.py"
-        with open(server_path) as f:
-            ast.parse(f.read())
-        print("✓ server.py syntax valid")
-        return True
-    except SyntaxError as e:
-        print(f"✗ server.py syntax error: {e}")
-        return False
-    except Exception as e:
-        print(f"✗ server.py error: {e}")
-        return False
+    return all_valid
 
 def test_dependencies():
     """Check for required external dependencies."""
@@ -78,12 +64,17 @@ def test_dependencies():
         "dotenv": "python-dotenv"
     }
 
+    # find_spec locates each module without executing it
     all_found = True
     for module_name, package_name in deps.items():
         try:
-            __import__(module_name)
-            print(f"✓ {package_name}")
+            found = importlib.util.find_spec(module_name) is not None
         except ImportError:
+            found = False  # Parent package is missing
+
+        if found:
+            print(f"✓ {package_name}")
+        else:
             print(f"✗ {package_name} (install with: uv pip install {package_name})")
             all_found = False
 
@@ -118,9 +109,7 @@ def main():
     print("=" * 60)
 
     tests = [
-        ("Standard library imports", test_imports),
-        ("Browser agent module", test_browser_agent),
-        ("Server module", test_server),
+        ("Server modules", test_modules),
         ("Configuration files", test_config_files),
         ("External dependencies", test_dependencies),
     ]
@@ -0,0 +1,228 @@
+"""Tests for the background task manager, using a stub browser agent."""
+
+import threading
+import time
+
+import pytest
+
+import task_manager
+from task_manager import BrowserTask, BrowserTaskManager, TaskStatus
+
+
+class FakeAgent:
+    """Stands in for GeminiBrowserAgent without a browser or Gemini.
+
+    A task whose description is in ``gates`` blocks until that event is
+    set or the agent is asked to stop.
+    """
+
+    gates: dict = {}
+    executed: list = []
+
+    def __init__(self, logger=None, browser_pool=None):
+        self._stop = threading.Event()
+        self.new_session()
+
+    def new_session(self):
+        self.progress_updates = []
+        self.progress_callback = None
+        self._stop.clear()
+
+    def request_stop(self):
+        self._stop.set()
+
+    def cleanup_browser(self):
+        pass
+
+    def _add_progress(self, message):
+        update = {"timestamp": "", "type": "info", "message": message}
+        self.progress_updates.append(update)
+        if self.progress_callback:
+            self.progress_callback(update)
+
+    def execute_task(self, task, url, save_screenshots=True):
+        FakeAgent.executed.append(task)
+        self._add_progress("step 1")
+        self._add_progress("step 2")
+
+        gate = FakeAgent.gates.get(task)
+        while gate and not gate.is_set():
+            if self._stop.is_set():
+                return {"ok": False, "error": "Task cancelled"}
+            time.sleep(0.01)
+
+        if task == "fail":
+            raise RuntimeError("boom")
+        return {"ok": True, "data": task}
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(task_manager, "GeminiBrowserAgent", FakeAgent)
+    monkeypatch.setattr(task_manager, "MAX_CONCURRENT_TASKS", 1)
+    FakeAgent.gates = {}
+    FakeAgent.executed = []
+    manager = BrowserTaskManager()
+    yield manager
+    for gate in FakeAgent.gates.values():
+        gate.set()
+    manager.shutdown(timeout=2)
+
+
+def status_of(manager, task_id):
+    return manager.get_task_status(task_id)["status"]
+
+
+def test_task_runs_to_completion(manager):
+    task_id = manager.create_task("hello")
+    assert manager.start_task(task_id)
+    wait_for(lambda: status_of(manager, task_id) == TaskStatus.COMPLETED)
+
+    status = manager.get_task_status(task_id)
+    assert status["result"] == {"ok": True, "data": "hello"}
+    assert status["progress_summary"]["total_steps"] == 2
+    assert status["started_at"] and status["completed_at"]
+
+
+def test_failed_task_reports_error(manager):
+    task_id = manager.create_task("fail")
+    manager.start_task(task_id)
+    wait_for(lambda: status_of(manager, task_id) == TaskStatus.FAILED)
+    assert manager.get_task_status(task_id)["error"] == "boom"
+
+
+def test_workers_start_on_first_task(manager):
+    assert manager._workers == []
+    manager.start_task(manager.create_task("hello"))
+    assert len(manager._workers) == 1
+
+
+def test_queued_task_stays_pending_until_a_worker_is_free(manager):
+    FakeAgent.gates["first"] = threading.Event()
+    first = manager.create_task("first")
+    second = manager.create_task("second")
+    manager.start_task(first)
+    manager.start_task(second)
+    wait_for(lambda: status_of(manager, first) == TaskStatus.RUNNING)
+
+    status = manager.get_task_status(second)
+    assert status["status"] == TaskStatus.PENDING
+    assert status["started_at"] is None
+    # Already queued, so it can't be submitted twice
+    assert not manager.start_task(second)
+
+    FakeAgent.gates["first"].set()
+    wait_for(lambda: status_of(manager, second) == TaskStatus.COMPLETED)
+    assert FakeAgent.executed == ["first", "second"]
+
+
+def test_task_cancelled_while_queued_never_runs(manager):
+    FakeAgent.gates["first"] = threading.Event()
+    first = manager.create_task("first")
+    second = manager.create_task("second")
+    manager.start_task(first)
+    manager.start_task(second)
+    wait_for(lambda: status_of(manager, first) == TaskStatus.RUNNING)
+
+    assert manager.cancel_task(second)
+    FakeAgent.gates["first"].set()
+    wait_for(lambda: status_of(manager, first) == TaskStatus.COMPLETED)
+    # The worker has dequeued the cancelled task by the time the queue drains
+    wait_for(manager._queue.empty)
+    time.sleep(0.05)
+
+    status = manager.get_task_status(second)
+    assert status["status"] == TaskStatus.CANCELLED
+    assert status["started_at"] is None
+    assert "second" not in FakeAgent.executed
+
+
+def test_cancelled_running_task_is_not_overwritten(manager):
+    FakeAgent.gates["slow"] = threading.Event()
+    task_id = manager.create_task("slow")
+    manager.start_task(task_id)
+    task = manager.tasks[task_id]
+    wait_for(lambda: task.agent is not None)
+
+    assert manager.cancel_task(task_id)
+    assert not manager.cancel_task(task_id)
+    # The agent stops on its own and the worker hands it back to the pool
+    wait_for(lambda: task.agent is None)
+
+    assert task.status == TaskStatus.CANCELLED
+    assert task.result is None
+    assert manager._agent_pool.qsize() == 1
+
+
+def test_cleanup_removes_only_expired_finished_tasks(manager):
+    done = [manager.create_task(f"task {i}") for i in range(3)]
+    for task_id in done:
+        manager.start_task(task_id)
+    pending = manager.create_task("never started")
+    wait_for(lambda: all(
+        status_of(manager, task_id) == TaskStatus.COMPLETED for task_id in done
+    ))
+
+    manager.cleanup_old_tasks(max_age_hours=24)
+    assert len(manager.list_tasks()) == 4
+
+    manager.cleanup_old_tasks(max_age_hours=0)
+    assert [t["task_id"] for t in manager.list_tasks()] == [pending]
+    assert manager._completed_heap == []
+    assert manager.get_task_status(done[0]) is None
+
+
+def test_compact_dict_is_memoized_until_progress_or_status_changes():
+    task = BrowserTask("id", "desc", "https://example.com")
+    first = task.to_compact_dict()
+    cache = task._compact_cache
+    assert task.to_compact_dict() == first
+    assert task._compact_cache is cache
+
+    task.add_progress({"timestamp": "", "type": "info", "message": "step"})
+    summary = task.to_compact_dict()["progress_summary"]
+    assert summary == {"total_steps": 1, "recent_actions": ("step",)}
+
+    task.status = TaskStatus.RUNNING
+    assert task.to_compact_dict()["status"] == TaskStatus.RUNNING
+
+    task.result = {"ok": True}
+    task.invalidate_cache()
+    task.status = TaskStatus.COMPLETED
+    assert task.to_compact_dict()["result"] == {"ok": True}
+
+
+def test_returned_dicts_do_not_share_mutable_state():
+    task = BrowserTask("id", "desc", "https://example.com")
+    task.add_progress({"timestamp": "", "type": "info", "message": "step"})
+
+    compact = task.to_compact_dict()
+    compact["status"] = "changed"
+    compact["progress_summary"]["total_steps"] = 99
+    assert task.to_compact_dict()["status"] == TaskStatus.PENDING
+    assert task.to_compact_dict()["progress_summary"]["total_steps"] == 1
+
+    full = task.to_dict()
+    assert isinstance(full["progress"], tuple)
+    full["status"] = "changed"
+    assert task.to_dict()["status"] == TaskStatus.PENDING
+
+
+def test_progress_keeps_only_the_most_recent_updates():
+    task = BrowserTask("id", "desc", "https://example.com")
+    for i in range(task_manager.MAX_PROGRESS_UPDATES + 5):
+        task.add_progress({"timestamp": "", "type": "info", "message": str(i)})
+
+    full = task.to_dict()
+    assert len(full["progress"]) == task_manager.MAX_PROGRESS_UPDATES
+    summary = task.to_compact_dict()["progress_summary"]
+    assert summary["total_steps"] == task_manager.MAX_PROGRESS_UPDATES + 5
+    assert summary["recent_actions"][-1] == str(task_manager.MAX_PROGRESS_UPDATES + 4)